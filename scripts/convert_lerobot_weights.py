@@ -3,14 +3,22 @@
 Convert LeRobot weights to OpenPI format by stripping the 'model.' prefix from all keys.
 
 This script loads a safetensors file from LeRobot (which has 'model.' prefix on all keys)
-and saves a new safetensors file with the prefix removed for compatibility with OpenPI.
+and saves a new safetensors file with the prefix removed for compatibility with OpenPI. Since only the keys
+change, by default just the file header is rewritten and the tensor data is copied verbatim.
 
 Usage:
     python scripts/convert_lerobot_weights.py --input_path /path/to/lerobot/model.safetensors --output_dir /path/to/output
 """
 
+import collections
+import concurrent.futures
+import fcntl
+import gc
+import json
 import os
 import shutil
+import struct
+import sys
 from pathlib import Path
 
 import safetensors
@@ -18,14 +26,339 @@ import safetensors.torch
 import torch
 import tyro
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def convert_lerobot_weights(input_path: str, output_dir: str):
+
+# Prefix LeRobot adds to every parameter name.
+_LEROBOT_PREFIX = "model."
+
+# Chunk size used when tensor data has to be copied through user space.
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+# safetensors names of the dtypes that `_save_file` can write directly.
+_SAFETENSORS_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+# ioctl request for cloning a whole file on Linux (btrfs, XFS, ...). Only exposed by the fcntl module from Python 3.12.
+_FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+
+def _read_header(path: Path) -> dict:
+    """Read the JSON header of a safetensors file, which maps tensor names to their dtype, shape and byte offsets."""
+    with path.open("rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(header_len))
+
+
+def _dumps(obj) -> bytes:
+    """Encode `obj` as compact JSON, using orjson if it is installed since headers of large models can be big."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # Like safetensors and orjson, write non-ASCII characters as UTF-8 rather than escaping them, so that renamed
+    # headers never grow.
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _pad_header(header_bytes: bytes) -> bytes:
+    """Pad an encoded header with spaces to a multiple of 8 bytes, as safetensors does, to keep tensor data aligned."""
+    return header_bytes + b" " * (-len(header_bytes) % 8)
+
+
+def _convert_keys(keys) -> dict[str, str]:
+    """Map each LeRobot key to its OpenPI name by stripping the 'model.' prefix.
+
+    Raises a ValueError if two keys would end up with the same name.
+    """
+    key_map = {key: key.removeprefix(_LEROBOT_PREFIX) for key in keys}
+    if len(set(key_map.values())) != len(key_map):
+        sources = collections.defaultdict(list)
+        for key, new_key in key_map.items():
+            sources[new_key].append(key)
+        collisions = [keys for keys in sources.values() if len(keys) > 1]
+        raise ValueError(f"Keys collide after stripping the '{_LEROBOT_PREFIX}' prefix: {collisions}")
+    return key_map
+
+
+def _reflink(src, dst) -> bool:
+    """Make `dst` share all data blocks of `src` on a copy-on-write filesystem. Returns whether this succeeded."""
+    # `_FICLONE` is a Linux ioctl number; other platforms use the same number for unrelated requests.
+    if sys.platform != "linux":
+        return False
+    try:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def _fadvise(fd: int, *advice: str):
+    """Apply the named `os.POSIX_FADV_*` hints to the whole file.
+
+    These are only hints, so this does nothing on platforms without posix_fadvise or files that do not support it.
+    """
+    try:
+        for name in advice:
+            os.posix_fadvise(fd, 0, 0, getattr(os, name))
+    except (AttributeError, OSError):
+        pass
+
+
+def _write_all(fd: int, data):
+    """Write all of `data`, which may be any buffer, to `fd` without copying it."""
+    view = memoryview(data).cast("B")
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def _copy_data(src, dst, offset: int, count: int):
+    """Copy `count` bytes starting at `offset` in `src` to the current position of `dst`.
+
+    Uses copy_file_range so the data never passes through user space, then sendfile, which also copies inside the
+    kernel but works on older kernels and across filesystems. Falls back to copying in fixed-size chunks through user
+    space where neither is supported, so memory use never depends on the file size. Each method starts where the
+    previous one stopped; one that copies nothing (as copy_file_range does on some FUSE filesystems) is treated as
+    unsupported. Raises an OSError if `src` ends before `count` bytes were copied.
+    """
+    try:
+        while count > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
+            if copied == 0:
+                break
+            offset += copied
+            count -= copied
+    except (AttributeError, OSError):
+        pass
+
+    try:
+        while count > 0:
+            # Explicitly request large chunks; sendfile is otherwise often used with page-sized counts.
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, min(count, _CHUNK_SIZE))
+            if sent == 0:
+                break
+            offset += sent
+            count -= sent
+    except (AttributeError, OSError):
+        pass
+
+    while count > 0:
+        chunk = os.pread(src.fileno(), min(count, _CHUNK_SIZE), offset)
+        if not chunk:
+            raise OSError(f"Unexpected end of {src.name}: {count} bytes could not be copied")
+        _write_all(dst.fileno(), chunk)
+        offset += len(chunk)
+        count -= len(chunk)
+
+
+def _fast_copy(src: Path, dst: Path) -> Path:
+    """Copy a file and its metadata, like `shutil.copy2`, using copy_file_range where available.
+
+    On copy-on-write filesystems this creates a reflink, and on NFS the copy is done server-side.
+    """
+    if dst.exists() and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src} and {dst} are the same file")
+    with open(src, "rb") as fsrc, open(dst, "wb", buffering=0) as fdst:
+        _copy_data(fsrc, fdst, 0, os.fstat(fsrc.fileno()).st_size)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def _fast_copytree(src: Path, dst: Path):
+    """Recursively copy the directory `src` to `dst` with `_fast_copy`, like `shutil.copytree(dirs_exist_ok=True)`.
+
+    Uses the file type information from `os.scandir` instead of an extra stat call per entry.
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    with os.scandir(src) as it:
+        for entry in it:
+            if entry.is_dir():
+                _fast_copytree(Path(entry.path), dst / entry.name)
+            else:
+                _fast_copy(Path(entry.path), dst / entry.name)
+    shutil.copystat(src, dst)
+
+
+def _convert_header(header: dict) -> tuple[bytes, dict[str, str]]:
+    """Rename the tensors in a parsed safetensors header.
+
+    Returns the encoded new header, without padding, and the mapping from old to new keys.
+    """
+    metadata = header.pop("__metadata__", None)
+    key_map = _convert_keys(header)
+    new_header = {key_map[key]: value for key, value in header.items()}
+    if metadata is not None:
+        new_header["__metadata__"] = metadata
+    return _dumps(new_header), key_map
+
+
+def _patch_header(path: Path) -> dict[str, str]:
+    """Rename the tensors of the safetensors file at `path` in place by overwriting only its header.
+
+    The new header is padded with spaces to the original size so that no tensor data has to move. Returns the mapping
+    from old to new keys.
+    """
+    with path.open("r+b") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        new_header_bytes, key_map = _convert_header(json.loads(f.read(header_len)))
+        if len(new_header_bytes) > header_len:
+            raise ValueError(f"Renamed header of {path} does not fit in the original header")
+        f.seek(8)
+        f.write(new_header_bytes.ljust(header_len))
+    return key_map
+
+
+def _stream_convert(input_file: Path, output_file: Path) -> dict[str, str]:
+    """Write a copy of `input_file` with renamed keys by rewriting only the safetensors header.
+
+    Stripping the key prefix does not change any tensor data, and tensor offsets are relative to the end of the
+    header, so the data section (all tensors, in file order) is streamed to the output verbatim without ever being
+    parsed into tensors. Peak memory is bounded by `_CHUNK_SIZE`. Returns the mapping from old to new keys.
+    """
+    with input_file.open("rb") as src, output_file.open("wb", buffering=0) as dst:
+        (header_len,) = struct.unpack("<Q", src.read(8))
+        new_header_bytes, key_map = _convert_header(json.loads(src.read(header_len)))
+        if len(new_header_bytes) <= header_len:
+            # Pad the header with spaces to its original size. This is always possible when only stripping prefixes,
+            # and keeps tensor data at the same offset, so the whole file can be cloned and only the header patched.
+            new_header_bytes = new_header_bytes.ljust(header_len)
+            if _reflink(src, dst):
+                os.pwrite(dst.fileno(), new_header_bytes, 8)
+                print("Cloned tensor data with a reflink")
+                return key_map
+        else:
+            new_header_bytes = _pad_header(new_header_bytes)
+        dst.write(struct.pack("<Q", len(new_header_bytes)) + new_header_bytes)
+
+        # The data is read once, front to back, and never again. Only hint this here, after cloning failed, since
+        # WILLNEED starts reading the whole file into the page cache.
+        _fadvise(src.fileno(), "POSIX_FADV_SEQUENTIAL", "POSIX_FADV_WILLNEED")
+        try:
+            data_offset = 8 + header_len
+            _copy_data(src, dst, data_offset, os.fstat(src.fileno()).st_size - data_offset)
+        finally:
+            _fadvise(src.fileno(), "POSIX_FADV_DONTNEED")
+
+    return key_map
+
+
+def _save_file(tensors: dict[str, torch.Tensor], path: Path, metadata: dict[str, str] | None):
+    """Save `tensors` in safetensors format, like `safetensors.torch.save_file`, but without copying tensor data.
+
+    save_file copies every tensor into a new bytes object before writing it. Here each tensor's memory is written
+    directly through a uint8 view instead. Falls back to save_file for dtypes not in `_SAFETENSORS_DTYPES` and on
+    big-endian hosts, where tensor data has to be byte-swapped to the little-endian safetensors format.
+    """
+    if sys.byteorder != "little" or any(tensor.dtype not in _SAFETENSORS_DTYPES for tensor in tensors.values()):
+        safetensors.torch.save_file(tensors, str(path), metadata=metadata)
+        return
+
+    header = {} if metadata is None else {"__metadata__": metadata}
+    offset = 0
+    for key, tensor in tensors.items():
+        size = tensor.numel() * tensor.element_size()
+        header[key] = {
+            "dtype": _SAFETENSORS_DTYPES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+
+    header_bytes = _pad_header(_dumps(header))
+    with path.open("wb", buffering=0) as f:
+        _write_all(f.fileno(), struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for tensor in tensors.values():
+            # A flat uint8 view shares memory with the tensor, so `.numpy()` does not copy (bfloat16 has no numpy
+            # equivalent, but uint8 does). The host is little-endian, so the bytes are already in safetensors order.
+            _write_all(f.fileno(), tensor.contiguous().reshape(-1).view(torch.uint8).numpy())
+
+
+def _reserialize(input_file: Path, output_file: Path, *, bulk_read: bool) -> dict[str, str]:
+    """Load all tensors from `input_file` and save them to `output_file` under their new names.
+
+    Returns the mapping from old to new keys.
+    """
+    header = _read_header(input_file)
+    metadata = header.pop("__metadata__", None)
+
+    if bulk_read:
+        # safe_open memory-maps the file, and every get_tensor call then faults its pages in one at a time. Each fault
+        # becomes a small synchronous read, which is slow on network and FUSE filesystems. A single read lets the
+        # filesystem issue large sequential requests instead. The file is not read again, so drop it from the page
+        # cache afterwards.
+        with input_file.open("rb") as f:
+            _fadvise(f.fileno(), "POSIX_FADV_SEQUENTIAL")
+            data = f.read()
+            _fadvise(f.fileno(), "POSIX_FADV_DONTNEED")
+        converted_state_dict = safetensors.torch.load(data)
+        del data
+
+        # Pop entries while building the renamed dict so that each tensor is referenced by only one of them. Renaming
+        # in place is not safe, since a new name can equal a key that has not been renamed yet ('model.model.x').
+        key_map = _convert_keys(converted_state_dict)
+        converted_state_dict = {key_map[key]: converted_state_dict.pop(key) for key in list(converted_state_dict)}
+        print(f"Loaded {len(converted_state_dict)} tensors")
+
+        _save_file(converted_state_dict, output_file, metadata)
+    else:
+        # Keep the input file open while saving so that tensors are read lazily from the mmap and renamed on the fly,
+        # instead of holding both the original and the converted state dict in memory at the same time. Tensors are
+        # fetched in the order they are stored in the file so reads stay sequential, and a thread pool overlaps disk
+        # reads with tensor construction.
+        keys = sorted(header, key=lambda k: header[k]["data_offsets"][0])
+        with (
+            safetensors.safe_open(str(input_file), framework="pt") as f,
+            concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor,
+        ):
+            key_map = _convert_keys(keys)
+            futures = {new_key: executor.submit(f.get_tensor, key) for key, new_key in key_map.items()}
+            converted_state_dict = {new_key: future.result() for new_key, future in futures.items()}
+            del futures
+            print(f"Loaded {len(converted_state_dict)} tensors")
+
+            # Save converted weights
+            _save_file(converted_state_dict, output_file, metadata)
+
+    del converted_state_dict
+    gc.collect()
+    return key_map
+
+
+def convert_lerobot_weights(
+    input_path: str,
+    output_dir: str,
+    *,
+    copy_all: bool = False,
+    reserialize: bool = False,
+    bulk_read: bool = False,
+    verbose: bool = False,
+):
     """
     Convert LeRobot weights to OpenPI format.
 
     Args:
         input_path: Path to the input safetensors file (or directory containing model.safetensors)
         output_dir: Directory to save the converted weights
+        copy_all: Copy the entire input directory verbatim (as reflinks where the filesystem supports them) and then
+            rename the tensors by patching the header of the copied weights in place, instead of copying only the
+            known config files. No tensor data is read.
+        reserialize: Load every tensor and save it again through safetensors instead of only rewriting the file
+            header. This is much slower, but validates all tensor data.
+        bulk_read: With --reserialize, read the whole input file with one sequential read instead of memory-mapping
+            it. This is much faster when the checkpoint lives on a network or FUSE filesystem, at the cost of holding
+            the file in memory.
+        verbose: Print the old and new name of every tensor.
     """
     # Handle input path - can be file or directory
     input_path = Path(input_path)
@@ -38,56 +371,78 @@ def convert_lerobot_weights(input_path: str, output_dir: str):
 
     if not input_file.exists():
         raise FileNotFoundError(f"Input file not found: {input_file}")
-
-    print(f"Loading weights from: {input_file}")
-
-    # Load the safetensors file
-    state_dict = {}
-    with safetensors.safe_open(str(input_file), framework="pt") as f:
-        for key in f.keys():
-            state_dict[key] = f.get_tensor(key)
-
-    print(f"Loaded {len(state_dict)} tensors")
-
-    # Strip 'model.' prefix from all keys
-    converted_state_dict = {}
-    for key, value in state_dict.items():
-        if key.startswith("model."):
-            new_key = key[6:]  # Remove 'model.' prefix (6 characters)
-            converted_state_dict[new_key] = value
-            print(f"  {key} -> {new_key}")
-        else:
-            converted_state_dict[key] = value
-            print(f"  {key} (no change)")
+    if copy_all and reserialize:
+        raise ValueError("--copy-all cannot be combined with --reserialize")
+    if bulk_read and not reserialize:
+        raise ValueError("--bulk-read requires --reserialize")
 
     # Create output directory
     output_dir = Path(output_dir)
+    if copy_all and input_dir.resolve() in output_dir.resolve().parents:
+        raise ValueError(f"With --copy-all, the output directory cannot be inside the input directory: {output_dir}")
     output_dir.mkdir(parents=True, exist_ok=True)
-
-    # Save converted weights
     output_file = output_dir / "model.safetensors"
-    print(f"\nSaving converted weights to: {output_file}")
-    safetensors.torch.save_file(converted_state_dict, str(output_file))
-
-    # Copy other files from input directory if they exist
-    files_to_copy = [
-        "config.json",
-        "train_config.json",
-        "policy_preprocessor.json",
-        "policy_postprocessor.json",
-        "policy_preprocessor_step_2_normalizer_processor.safetensors",
-        "policy_postprocessor_step_0_unnormalizer_processor.safetensors",
-    ]
-
-    for filename in files_to_copy:
-        src = input_dir / filename
-        if src.exists():
-            dst = output_dir / filename
-            print(f"Copying {filename}")
-            shutil.copy2(src, dst)
+
+    if copy_all:
+        if not output_dir.samefile(input_dir):
+            print(f"Copying {input_dir} to: {output_dir}")
+            _fast_copytree(input_dir, output_dir)
+            if input_file.name != output_file.name:
+                (output_dir / input_file.name).replace(output_file)
+        elif input_file.name != output_file.name:
+            _fast_copy(input_file, output_file)
+        key_map = _patch_header(output_file)
+        print(f"Converted weights in place: {output_file}")
+    elif not reserialize and output_file.exists() and output_file.samefile(input_file):
+        print(f"Converting weights in place: {input_file}")
+        key_map = _patch_header(input_file)
+    else:
+        # Write to a temporary file and move it into place afterwards, so that converting into the input directory
+        # never truncates the input before it has been read.
+        tmp_file = output_file.with_name(f"{output_file.name}.tmp")
+        try:
+            if reserialize:
+                print(f"Loading weights from: {input_file}")
+                key_map = _reserialize(input_file, tmp_file, bulk_read=bulk_read)
+            else:
+                print(f"Converting weights from: {input_file}")
+                key_map = _stream_convert(input_file, tmp_file)
+            tmp_file.replace(output_file)
+        finally:
+            tmp_file.unlink(missing_ok=True)
+        print(f"Saved converted weights to: {output_file}")
+
+    num_renamed = sum(new_key != key for key, new_key in key_map.items())
+    print(f"Renamed {num_renamed} of {len(key_map)} tensors")
+    if verbose:
+        # Emit all lines with a single write; printing one line per tensor is slow for large models.
+        lines = [
+            f"  {key} -> {new_key}" if new_key != key else f"  {key} (no change)" for key, new_key in key_map.items()
+        ]
+        sys.stdout.write("\n".join(lines) + "\n")
+
+    if not copy_all and not output_dir.samefile(input_dir):
+        # Copy other files from input directory if they exist
+        files_to_copy = [
+            "config.json",
+            "train_config.json",
+            "policy_preprocessor.json",
+            "policy_postprocessor.json",
+            "policy_preprocessor_step_2_normalizer_processor.safetensors",
+            "policy_postprocessor_step_0_unnormalizer_processor.safetensors",
+        ]
+
+        # Copies are dominated by per-file syscall latency rather than bandwidth, so run them concurrently.
+        copied = [filename for filename in files_to_copy if (input_dir / filename).exists()]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(_fast_copy, input_dir / filename, output_dir / filename) for filename in copied]
+            for future in futures:
+                future.result()
+        if copied:
+            print(f"Copied {', '.join(copied)}")
 
     print(f"\nConversion complete! Output saved to: {output_dir}")
-    print(f"Total tensors converted: {len(converted_state_dict)}")
+    print(f"Total tensors converted: {len(key_map)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+import os
+import pathlib
+import shutil
+
+import pytest
+import safetensors.torch
+import torch
+
+from . import convert_lerobot_weights
+
+
+def _make_checkpoint(path: pathlib.Path) -> dict[str, torch.Tensor]:
+    path.mkdir(parents=True, exist_ok=True)
+    tensors = {
+        "model.paligemma.weight": torch.randn(4, 3),
+        "model.action_in_proj.bias": torch.arange(5, dtype=torch.int32),
+        "model.time_mlp.weight": torch.randn(2, 2).to(torch.bfloat16),
+        "no_prefix": torch.ones(1),
+    }
+    safetensors.torch.save_file(tensors, str(path / "model.safetensors"), metadata={"format": "pt"})
+    (path / "config.json").write_text('{"type": "pi0"}')
+    return tensors
+
+
+def _assert_converted(output_file: pathlib.Path, tensors: dict[str, torch.Tensor]):
+    converted = safetensors.torch.load_file(str(output_file))
+    assert set(converted) == {key.removeprefix("model.") for key in tensors}
+    for key, value in tensors.items():
+        assert torch.equal(converted[key.removeprefix("model.")], value)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"reserialize": True}, {"reserialize": True, "bulk_read": True}], ids=["header", "mmap", "bulk"]
+)
+def test_convert_lerobot_weights(tmp_path: pathlib.Path, kwargs: dict):
+    tensors = _make_checkpoint(tmp_path / "input")
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"), **kwargs)
+
+    output_file = tmp_path / "output" / "model.safetensors"
+    _assert_converted(output_file, tensors)
+    with safetensors.safe_open(str(output_file), framework="pt") as f:
+        assert f.metadata() == {"format": "pt"}
+    assert (tmp_path / "output" / "config.json").read_text() == '{"type": "pi0"}'
+
+
+def test_convert_lerobot_weights_from_file(tmp_path: pathlib.Path):
+    tensors = _make_checkpoint(tmp_path / "input")
+
+    convert_lerobot_weights.convert_lerobot_weights(
+        str(tmp_path / "input" / "model.safetensors"), str(tmp_path / "output")
+    )
+
+    _assert_converted(tmp_path / "output" / "model.safetensors", tensors)
+    assert (tmp_path / "output" / "config.json").exists()
+
+
+@pytest.mark.parametrize(
+    "patches",
+    [{"copy_file_range": None}, {"copy_file_range": None, "sendfile": None}, {"copy_file_range": lambda *args: 0}],
+    ids=["sendfile", "pread", "copy_file_range_copies_nothing"],
+)
+def test_convert_lerobot_weights_copy_fallback(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, patches: dict):
+    monkeypatch.setattr(convert_lerobot_weights, "_CHUNK_SIZE", 7)
+    for name, replacement in patches.items():
+        if replacement is None:
+            monkeypatch.delattr(os, name)
+        else:
+            monkeypatch.setattr(os, name, replacement)
+    tensors = _make_checkpoint(tmp_path / "input")
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"))
+
+    _assert_converted(tmp_path / "output" / "model.safetensors", tensors)
+    assert (tmp_path / "output" / "config.json").read_text() == '{"type": "pi0"}'
+
+
+def test_copy_data_truncated_source(tmp_path: pathlib.Path):
+    (tmp_path / "src").write_bytes(b"0123456789")
+
+    with (
+        open(tmp_path / "src", "rb") as src,
+        open(tmp_path / "dst", "wb", buffering=0) as dst,
+        pytest.raises(OSError, match="Unexpected end"),
+    ):
+        convert_lerobot_weights._copy_data(src, dst, 4, 10)  # noqa: SLF001
+
+
+def test_convert_lerobot_weights_reflink(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    def fake_reflink(src, dst) -> bool:
+        # Stand in for a copy-on-write clone, which is not supported on the filesystems tests run on.
+        dst.write(pathlib.Path(src.name).read_bytes())
+        return True
+
+    monkeypatch.setattr(convert_lerobot_weights, "_reflink", fake_reflink)
+    tensors = _make_checkpoint(tmp_path / "input")
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"))
+
+    output_file = tmp_path / "output" / "model.safetensors"
+    assert output_file.stat().st_size == (tmp_path / "input" / "model.safetensors").stat().st_size
+    _assert_converted(output_file, tensors)
+
+
+def test_convert_lerobot_weights_copy_all(tmp_path: pathlib.Path):
+    tensors = _make_checkpoint(tmp_path / "input")
+    (tmp_path / "input" / "assets" / "franka").mkdir(parents=True)
+    (tmp_path / "input" / "assets" / "franka" / "norm_stats.json").write_text("{}")
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"), copy_all=True)
+
+    output_file = tmp_path / "output" / "model.safetensors"
+    assert output_file.stat().st_size == (tmp_path / "input" / "model.safetensors").stat().st_size
+    _assert_converted(output_file, tensors)
+    assert (tmp_path / "output" / "config.json").read_text() == '{"type": "pi0"}'
+    assert (tmp_path / "output" / "assets" / "franka" / "norm_stats.json").read_text() == "{}"
+    # The input checkpoint must not be modified.
+    assert set(safetensors.torch.load_file(str(tmp_path / "input" / "model.safetensors"))) == set(tensors)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"reserialize": True}], ids=["header", "reserialize"])
+def test_convert_lerobot_weights_in_place(tmp_path: pathlib.Path, kwargs: dict):
+    tensors = _make_checkpoint(tmp_path)
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path), str(tmp_path), **kwargs)
+
+    _assert_converted(tmp_path / "model.safetensors", tensors)
+    assert not (tmp_path / "model.safetensors.tmp").exists()
+    assert (tmp_path / "config.json").read_text() == '{"type": "pi0"}'
+
+
+def test_fast_copy_same_file(tmp_path: pathlib.Path):
+    (tmp_path / "config.json").write_text("{}")
+
+    with pytest.raises(shutil.SameFileError):
+        convert_lerobot_weights._fast_copy(tmp_path / "config.json", tmp_path / "config.json")  # noqa: SLF001
+    assert (tmp_path / "config.json").read_text() == "{}"
+
+
+def test_convert_lerobot_weights_copy_all_in_place(tmp_path: pathlib.Path):
+    tensors = _make_checkpoint(tmp_path)
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path), str(tmp_path), copy_all=True)
+
+    _assert_converted(tmp_path / "model.safetensors", tensors)
+    assert (tmp_path / "config.json").read_text() == '{"type": "pi0"}'
+
+
+def test_convert_lerobot_weights_copy_all_into_input(tmp_path: pathlib.Path):
+    _make_checkpoint(tmp_path / "input")
+
+    with pytest.raises(ValueError, match="inside the input directory"):
+        convert_lerobot_weights.convert_lerobot_weights(
+            str(tmp_path / "input"), str(tmp_path / "input" / "converted"), copy_all=True
+        )
+    assert not (tmp_path / "input" / "converted").exists()
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"copy_all": True}], ids=["header", "copy_all"])
+def test_convert_lerobot_weights_non_ascii_metadata(tmp_path: pathlib.Path, kwargs: dict):
+    (tmp_path / "input").mkdir()
+    metadata = {"description": "Greifer \u00f6ffnen \u2014 \u62fe\u3044\u4e0a\u3052"}
+    safetensors.torch.save_file(
+        {"model.weight": torch.ones(2)}, str(tmp_path / "input" / "model.safetensors"), metadata=metadata
+    )
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"), **kwargs)
+
+    output_file = tmp_path / "output" / "model.safetensors"
+    assert output_file.stat().st_size == (tmp_path / "input" / "model.safetensors").stat().st_size
+    with safetensors.safe_open(str(output_file), framework="pt") as f:
+        assert f.metadata() == metadata
+        assert torch.equal(f.get_tensor("weight"), torch.ones(2))
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{}, {"copy_all": True}, {"reserialize": True}, {"reserialize": True, "bulk_read": True}],
+    ids=["header", "copy_all", "mmap", "bulk"],
+)
+def test_convert_lerobot_weights_colliding_keys(tmp_path: pathlib.Path, kwargs: dict):
+    (tmp_path / "input").mkdir()
+    safetensors.torch.save_file(
+        {"model.x": torch.ones(2), "x": torch.zeros(2)}, str(tmp_path / "input" / "model.safetensors")
+    )
+
+    with pytest.raises(ValueError, match="collide"):
+        convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"), **kwargs)
+
+
+def test_convert_lerobot_weights_bulk_read_requires_reserialize(tmp_path: pathlib.Path):
+    _make_checkpoint(tmp_path / "input")
+
+    with pytest.raises(ValueError, match="--bulk-read requires --reserialize"):
+        convert_lerobot_weights.convert_lerobot_weights(
+            str(tmp_path / "input"), str(tmp_path / "output"), bulk_read=True
+        )
+    assert not (tmp_path / "output").exists()
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"reserialize": True}, {"reserialize": True, "bulk_read": True}], ids=["header", "mmap", "bulk"]
+)
+def test_convert_lerobot_weights_double_prefix(tmp_path: pathlib.Path, kwargs: dict):
+    (tmp_path / "input").mkdir()
+    tensors = {}
+    for i in range(8):
+        tensors[f"model.model.{i}"] = torch.full((2,), float(i))
+        tensors[f"model.{i}"] = torch.full((2,), -float(i))
+    safetensors.torch.save_file(tensors, str(tmp_path / "input" / "model.safetensors"))
+
+    convert_lerobot_weights.convert_lerobot_weights(str(tmp_path / "input"), str(tmp_path / "output"), **kwargs)
+
+    _assert_converted(tmp_path / "output" / "model.safetensors", tensors)